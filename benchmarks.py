@@ -0,0 +1,265 @@
+#!/usr/bin/env python3
+"""Benchmark module for csu.py
+
+Times and memory-profiles each stage of the update workflow on synthetic sheets, without network,
+and compares the results with the baseline stored in benchmark_baselines/rows_<rows>.json."""
+
+import argparse
+import gc
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from unittest import mock
+
+import numbers_parser
+import openpyxl
+from openpyxl.worksheet.table import Table
+
+from csu_types import Config, Coin
+from csu_helpers import round_float
+from csu_providers import CMCProvider
+from csu import load_numbers_doc, load_excel_doc, prepare_dataset, get_data_from_provider, update_numbers_sheet, update_excel_sheet
+
+BASELINE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmark_baselines")
+
+class CSUBenchConfig:
+    """Config (csu_config.py) pointing to the synthetic sheets."""
+    def __init__(self, sheet_type: str, input_path: str, output_path: str, table_name: str):
+        self.doc = {
+            "type": sheet_type,
+            "input_path": input_path,
+            "output_path": output_path
+        }
+
+        self.sheet = {
+            "index": 0
+        }
+
+        self.table = {
+            "name": table_name,
+            "start_row_index": 1,
+            "end_row_index": 0,
+            "coin_name_col_index": 0,
+            "coin_price_col_index": 3,
+            "date_col_index": 2
+        }
+
+        self.cmc_api = {
+            "url": "http://cmc.invalid/v2/cryptocurrency/quotes/latest",
+            "token": "token1"
+        }
+
+class FakeResponse:
+    """Stands for a requests.Response of CoinMarketCap API."""
+    def __init__(self, rsp_json):
+        self.rsp_json = rsp_json
+
+    def json(self):
+        """Returns the prepared JSON answer."""
+        return self.rsp_json
+
+def token_names(rows: int) -> list[str]:
+    """Returns unique token names."""
+    return [f"T{i}" for i in range(rows)]
+
+def token_price(index: int) -> float:
+    """Returns a price with a variable number of leading zeros, within Numbers 15 significant digits."""
+    return float(f"{(index % 97 + 1.123456789) * 10.0 ** (index % 13 - 6):.12g}")
+
+def write_excel_sheet(path: str, rows: int):
+    """Writes a synthetic Excel sheet with a title row and rows tokens."""
+    doc = openpyxl.Workbook()
+    sheet = doc.active
+    sheet.append(["Token", "Quantity", "Date", "Price"])
+    for i, name in enumerate(token_names(rows)):
+        sheet.append([name, i, "01/01/2024", token_price(i)])
+    sheet.add_table(Table(displayName="table_1", ref=f"A1:D{rows + 1}"))
+    doc.save(path)
+
+def write_numbers_sheet(path: str, rows: int):
+    """Writes a synthetic Numbers sheet with a title row and rows tokens."""
+    doc = numbers_parser.Document(num_header_rows=1, num_rows=rows + 1, num_cols=4)
+    table = doc.sheets[0].tables[0]
+    table.name = "Table 1"
+    for col, title in enumerate(["Token", "Quantity", "Date", "Price"]):
+        table.write(0, col, title)
+    for i, name in enumerate(token_names(rows)):
+        table.write(i + 1, 0, name)
+        table.write(i + 1, 1, i)
+        table.write(i + 1, 2, "01/01/2024")
+        table.write(i + 1, 3, token_price(i))
+    doc.save(path)
+
+def cmc_answer(rows: int) -> dict:
+    """Returns a CoinMarketCap answer containing all the synthetic tokens."""
+    data = {name: [{"quote": {"USD": {"price": token_price(i)}}}] for i, name in enumerate(token_names(rows))}
+    return {"status": {"error_code": 0}, "data": data}
+
+def stages(directory: str, rows: int) -> list:
+    """Returns the benchmarked stages as (name, setup, run) where run(*setup()) is measured."""
+    excel_path = os.path.join(directory, "bench.xlsx")
+    numbers_path = os.path.join(directory, "bench.numbers")
+    write_excel_sheet(excel_path, rows)
+    write_numbers_sheet(numbers_path, rows)
+
+    config_ex = Config(CSUBenchConfig("excel", excel_path, os.path.join(directory, "bench_update.xlsx"), "table_1"))
+    config_nu = Config(CSUBenchConfig("numbers", numbers_path, os.path.join(directory, "bench_update.numbers"), "Table 1"))
+
+    prices = [token_price(i) for i in range(rows)]
+    coins = [Coin(name, round_float(token_price(i))) for i, name in enumerate(token_names(rows))]
+    provider = CMCProvider(config_ex.cmc_api_url, config_ex.cmc_api_token)
+
+    # Read only stages share their input, update stages get a fresh document each run.
+    excel_doc = load_excel_doc(config_ex)
+    numbers_doc = load_numbers_doc(config_nu)
+    token_list = prepare_dataset(excel_doc, config_ex)
+
+    def get_data(token_list):
+        for token_set in token_list:
+            get_data_from_provider(token_set, provider)
+
+    def round_prices():
+        for price in prices:
+            round_float(price)
+
+    return [
+        ("round_float", lambda: (), round_prices),
+        ("load_excel_doc", lambda: (config_ex,), load_excel_doc),
+        ("load_numbers_doc", lambda: (config_nu,), load_numbers_doc),
+        ("prepare_dataset_excel", lambda: (excel_doc, config_ex), prepare_dataset),
+        ("prepare_dataset_numbers", lambda: (numbers_doc, config_nu), prepare_dataset),
+        ("get_data_from_provider", lambda: (token_list,), get_data),
+        ("update_excel_sheet", lambda: (load_excel_doc(config_ex), coins, config_ex), update_excel_sheet),
+        ("update_numbers_sheet", lambda: (load_numbers_doc(config_nu), coins, config_nu), update_numbers_sheet),
+    ]
+
+def sample_time(setup, run, min_time: float) -> float:
+    """Returns the mean time of run(*setup()) over as many calls as needed to spend min_time,
+    so fast stages are not lost in timer noise. Garbage collection is kept out of the sample."""
+    spent = 0
+    calls = 0
+    gc.collect()
+    gc.disable()
+    try:
+        while spent < min_time:
+            args = setup()
+            start = time.perf_counter()
+            run(*args)
+            spent += time.perf_counter() - start
+            calls += 1
+    finally:
+        gc.enable()
+    return spent / calls
+
+def peak_memory(setup, run, runs: int) -> float:
+    """Returns the lowest peak memory allocated by run(*setup()) over runs runs, in KiB."""
+    peaks = []
+    for _ in range(runs):
+        args = setup()
+        gc.collect()
+        tracemalloc.start()
+        run(*args)
+        peaks.append(tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+    return min(peaks) / 1024
+
+def measure(bench_stages: list, repeat: int, min_time: float = 0.05, min_samples: int = 5, memory_runs: int = 3) -> dict:
+    """Returns the best time over repeat samples and the lowest peak memory of each stage.
+    At least min_samples samples are taken, so slow stages are not judged on a few unlucky runs.
+    Samples are taken one stage after the other, round after round, so a slow period of the machine
+    spreads over all stages instead of all the samples of one stage."""
+    times = {name: [] for name, _, _ in bench_stages}
+
+    # Warm up caches and imports.
+    for _, setup, run in bench_stages:
+        run(*setup())
+
+    for _ in range(max(repeat, min_samples)):
+        for name, setup, run in bench_stages:
+            times[name].append(sample_time(setup, run, min_time))
+
+    # Measured apart, as tracemalloc slows down the run.
+    return {name: {"seconds": round(min(times[name]), 6), "peak_kib": round(peak_memory(setup, run, memory_runs), 1)}
+            for name, setup, run in bench_stages}
+
+def compare(results: dict, baseline: dict, thresholds: dict, floors: dict = None) -> list[str]:
+    """Returns a message for each stage measure that exceeds its baseline by more than its threshold,
+    thresholds being given by measure name ({"seconds": 0.5, "peak_kib": 0.1}).
+    A measure must also exceed its baseline by its floor ({"seconds": 0.001}), so stages of a few
+    microseconds are not flagged for timer noise. A stage missing from the baseline is reported too."""
+    floors = floors or {}
+    regressions = []
+    for name, result in results.items():
+        reference = baseline.get(name)
+        if reference is None:
+            regressions.append(f"{name}: no baseline, run with --update to create it")
+            continue
+        for key, value in result.items():
+            if reference.get(key) and value > reference[key] * (1 + thresholds[key]) \
+                    and value - reference[key] > floors.get(key, 0):
+                regressions.append(f"{name} {key}: {value:.4g} vs {reference[key]:.4g} "\
+                                   f"(+{(value / reference[key] - 1) * 100:.0f}%)")
+    return regressions
+
+def main():
+    """Runs the benchmarks and compares or stores the baseline."""
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=1000, help="number of tokens in the synthetic tables")
+    parser.add_argument("--repeat", type=int, default=10, help="number of timed samples per stage (minimum 5), each the mean of as many calls as fit in 50 ms")
+    parser.add_argument("--time-threshold", type=float, default=0.5, help="allowed time increase over baseline, 0.5 is +50%%")
+    parser.add_argument("--time-floor", type=float, default=0.001, help="smallest time increase reported, in seconds")
+    parser.add_argument("--memory-threshold", type=float, default=0.1, help="allowed peak memory increase over baseline, 0.1 is +10%%")
+    parser.add_argument("--stage", action="append", help="only run this stage, can be repeated")
+    parser.add_argument("--update", action="store_true", help="store the results as the new baseline")
+    args = parser.parse_args()
+
+    baseline_path = os.path.join(BASELINE_DIR, f"rows_{args.rows}.json")
+    baseline = {}
+    if os.path.isfile(baseline_path):
+        with open(baseline_path, encoding="utf-8") as f:
+            baseline = json.load(f)["stages"]
+
+    # HTTP layer answers with all the synthetic tokens, so nothing leaves the machine.
+    response = FakeResponse(cmc_answer(args.rows))
+
+    with tempfile.TemporaryDirectory() as directory, mock.patch("csu_providers.requests.get", return_value=response):
+        all_stages = stages(directory, args.rows)
+        names = [name for name, _, _ in all_stages]
+
+        unknown = [name for name in args.stage or [] if name not in names]
+        if unknown:
+            sys.exit(f"Unknown stage(s) : {', '.join(unknown)}. Choose between {', '.join(names)}.")
+
+        bench_stages = [stage for stage in all_stages if not args.stage or stage[0] in args.stage]
+
+        if not args.update:
+            if not baseline:
+                sys.exit(f"No baseline for {args.rows} rows. Run with --update to create {baseline_path}.")
+            missing = [name for name, _, _ in bench_stages if name not in baseline]
+            if missing:
+                sys.exit(f"No baseline for stage(s) {', '.join(missing)} in {baseline_path}. Run with --update to add them.")
+
+        results = measure(bench_stages, args.repeat)
+
+    for name, result in results.items():
+        print(f"{name:<25} {result['seconds'] * 1000:10.2f} ms {result['peak_kib']:12.1f} KiB")
+
+    if args.update:
+        os.makedirs(BASELINE_DIR, exist_ok=True)
+        with open(baseline_path, "w", encoding="utf-8") as f:
+            json.dump({"rows": args.rows, "stages": {**baseline, **results}}, f, indent=4)
+            f.write("\n")
+        print(f"Baseline stored in {baseline_path}.")
+        return
+
+    regressions = compare(results, baseline, {"seconds": args.time_threshold, "peak_kib": args.memory_threshold},
+                          {"seconds": args.time_floor})
+    if regressions:
+        sys.exit("Regressions over baseline :\n" + "\n".join(regressions))
+    print("No regression over baseline.")
+
+if __name__ == "__main__":
+    main()
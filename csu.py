@@ -4,17 +4,18 @@
 from datetime import date
 import os
 import sys
-import requests
 import numbers_parser
 import openpyxl
 
 from csu_config import CSUConfig
 from csu_types import Config, SheetType, ExcelDoc, NumbersDoc, Coin
-from csu_helpers import round_float
+from csu_helpers import atomic_save, BackgroundWriter
+from csu_providers import PriceProvider, ProviderError, CMCProvider, JSONQuotesProvider, HedgedProvider
 
 def main():
     """Main function that contains the update workflow for the tracking sheet."""
     config = Config(CSUConfig())
+    provider = get_price_provider(config)
 
     if config.sheet_type == SheetType.NUMBERS:
         numbers_doc = load_numbers_doc(config)
@@ -22,13 +23,10 @@ def main():
 
         coins = []
         for token_set in token_list:
-            coins += get_data_from_cmc_api(token_set, config)
-
-        # As order can differs between input file and previous updated file, we detete it.
-        if config.input_path != config.output_path:
-            if os.path.isfile(config.output_path):
-                os.remove(config.output_path)
+            coins += get_data_from_provider(token_set, provider)
 
+        # The output file is fully re-created from the input one and atomically replaced,
+        # so order cannot differ from a previous updated file.
         update_numbers_sheet(numbers_doc, coins, config)
     else:
         excel_doc = load_excel_doc(config)
@@ -36,10 +34,12 @@ def main():
 
         coins = []
         for token_set in token_list:
-            coins += get_data_from_cmc_api(token_set, config)
+            coins += get_data_from_provider(token_set, provider)
 
         update_excel_sheet(excel_doc, coins, config)
 
+    provider.close()
+
 def load_numbers_doc(config: Config) -> NumbersDoc:
     """Returns a csu_types.NumbersDoc from an input file."""
     try:
@@ -125,47 +125,38 @@ def prepare_dataset(doc, config: Config):
     token_list.append(token_str)
     return token_list
 
-def get_data_from_cmc_api(token_set: str, config: Config) -> list[Coin]:
-    """Gets current price for a list of tokens from CoinMarketCap API."""
-    # Get data.
-    url = f"{config.cmc_api_url}?symbol={token_set}"
-    headers = {"X-CMC_PRO_API_KEY": config.cmc_api_token}
+def get_price_provider(config: Config) -> PriceProvider:
+    """Returns the CoinMarketCap provider, hedged with the fallback API when one is configured."""
+    provider = CMCProvider(config.cmc_api_url, config.cmc_api_token)
+
+    if not config.fallback_api_url:
+        return provider
+
+    fallback = JSONQuotesProvider(config.fallback_api_url,
+                                  headers=config.fallback_api_headers,
+                                  symbol_param=config.fallback_api_symbol_param,
+                                  prices_path=config.fallback_api_prices_path,
+                                  price_path=config.fallback_api_price_path)
+    # Response times are kept next to the output file, so the hedge delay tunes itself over runs.
+    stats_path = config.latency_stats_path
+    if not stats_path:
+        stats_path = os.path.join(os.path.dirname(os.path.abspath(config.output_path)), ".csu_latency.json")
+
+    return HedgedProvider(provider, fallback, percentile=config.hedge_percentile,
+                          initial_delay=config.hedge_initial_delay, stats_path=stats_path)
+
+def get_data_from_provider(token_set: str, provider: PriceProvider) -> list[Coin]:
+    """Gets current price for a list of tokens from a price provider."""
     try:
-        response = requests.get(url, headers=headers, timeout=10)
-    except (requests.ConnectTimeout, requests.HTTPError, requests.ReadTimeout,\
-            requests.Timeout, requests.ConnectionError, requests.exceptions.MissingSchema) as e:
-        sys.exit(f"ERROR : str{e}. Check the configured URL.")
-    rsp_json = response.json()
-
-    # Return in case of error.
-    if "status" not in rsp_json:
-        sys.exit(f"ERROR : unable to retrieve 'status' key in response for '{token_set}'. Brut response : {rsp_json}")
-
-    if "error_code" not in rsp_json["status"]:
-        sys.exit(f"ERROR : unable to retrieve 'status' key in response for '{token_set}'. Brut response : {rsp_json}")
-
-    if rsp_json["status"]["error_code"] != 0:
-        error_message = rsp_json.get("status", {}).get("error_message", "Unknown error")
-        sys.exit(f"ERROR : unable to fetch data for '{token_set}': {error_message}")
-
-    # Otherwise formats and returns a list of Coins.
-    tokens = token_set.split(",")
-    coins = []
-    for coin_name in tokens:
-        value = rsp_json["data"].get(coin_name, {})
-        if value:
-            price = value[0]["quote"]["USD"]["price"]
-            if price is None:
-                print(f"ERROR : no price for {coin_name}, price set to 0. Continuing.")
-            rounded_price = round_float(price)
-            coins.append(Coin(coin_name, rounded_price))
-        else:
-            print(f"ERROR : no value for {coin_name}, value set to 0. Continuing.")
-            coins.append(Coin(coin_name, 0))
+        return provider.fetch(token_set)
+    except ProviderError as e:
+        sys.exit(str(e))
 
-    return coins
+def get_data_from_cmc_api(token_set: str, config: Config) -> list[Coin]:
+    """Gets current price for a list of tokens from CoinMarketCap API."""
+    return get_data_from_provider(token_set, CMCProvider(config.cmc_api_url, config.cmc_api_token))
 
-def update_numbers_sheet(numbers_doc: NumbersDoc, coins: list[Coin], config: Config):
+def update_numbers_sheet(numbers_doc: NumbersDoc, coins: list[Coin], config: Config, writer: BackgroundWriter = None):
     """Update the output sheet from fresh data from CMC API."""
     cur_row_index = config.table_start_row_index
     cur_date = date.today().strftime('%d/%m/%Y')
@@ -181,9 +172,9 @@ def update_numbers_sheet(numbers_doc: NumbersDoc, coins: list[Coin], config: Con
 
         cur_row_index += 1
 
-    numbers_doc.doc.save(config.output_path)
+    save_doc(numbers_doc.doc.save, config.output_path, writer)
 
-def update_excel_sheet(excel_doc: ExcelDoc, coins: list[Coin], config: Config):
+def update_excel_sheet(excel_doc: ExcelDoc, coins: list[Coin], config: Config, writer: BackgroundWriter = None):
     """Update the output sheet from fresh data from CMC API."""
     cur_row_index = config.table_start_row_index
     cur_date = date.today().strftime('%d/%m/%Y')
@@ -197,7 +188,14 @@ def update_excel_sheet(excel_doc: ExcelDoc, coins: list[Coin], config: Config):
 
         cur_row_index += 1
 
-    excel_doc.doc.save(config.output_path)
+    save_doc(excel_doc.doc.save, config.output_path, writer)
+
+def save_doc(save, output_path: str, writer: BackgroundWriter = None):
+    """Atomically writes a document to output_path, on the writer thread if one is given."""
+    if writer is None:
+        atomic_save(save, output_path)
+    else:
+        writer.submit(save, output_path)
 
 if __name__ == "__main__":
     main()
@@ -55,3 +55,36 @@ class CSUConfig:
         # Your personnal token to access the API. Create an account on https://pro.coinmarketcap.com/ to get one.
         "token": "TOKEN"
     }
+
+    fallback_api = {
+        # URL of a secondary price API, used when CoinMarketCap fails or is slow. Leave empty to disable it.
+        # It is called as GET url?symbol=BTC,ETH,... and must answer with JSON.
+        "url": "",
+
+        # HTTP headers sent to the fallback API, for example an API key.
+        "headers": {},
+
+        # Name of the query parameter that receives the token list.
+        "symbol_param": "symbol",
+
+        # Keys leading from the JSON response to the object that maps each token to its quote.
+        # Empty if the response is directly {"BTC": {...}, "ETH": {...}}.
+        "prices_path": [],
+
+        # Keys leading from a token quote to its price in USD.
+        # Empty if the quote is directly the price, as in {"BTC": 68000.0}.
+        "price_path": [],
+
+        # When CoinMarketCap has not answered within this percentile of its own past response times,
+        # the same request is also sent to the fallback API and the first answer is used.
+        # Between 1 and 100.
+        "hedge_percentile": 95,
+
+        # Seconds to wait for CoinMarketCap before asking the fallback API, until 5 response times are known.
+        # Between 0 and +n.
+        "hedge_initial_delay": 1,
+
+        # JSON file that keeps the last response times between runs.
+        # If empty, .csu_latency.json is used in the folder of output_path.
+        "latency_stats_path": ""
+    }
@@ -1,6 +1,16 @@
 #!/usr/bin/env python3
 """Module that contains helper functions used in main module."""
 
+import os
+import queue
+import stat
+import tempfile
+import threading
+
+# Read once at import, os.umask() can only be read by changing it, which is unsafe once saves run on other threads.
+_UMASK = os.umask(0)
+os.umask(_UMASK)
+
 def round_float(num: float):
     """Rounds the last digits to two decimal places, keeping the intermediate zeros."""
     if num is None:
@@ -14,3 +24,88 @@ def round_float(num: float):
         zeros += 1
 
     return round(float(s), zeros+2)
+
+def atomic_save(save, path: str):
+    """Calls save(tmp_path) on a temp file next to path, fsyncs it and renames it over path.
+    On any error the temp file is removed, path is left untouched and the error is raised."""
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(prefix=f".{os.path.basename(path)}.", suffix=".tmp", dir=directory)
+    os.close(fd)
+
+    try:
+        save(tmp_path)
+        with open(tmp_path, "rb") as f:
+            os.fsync(f.fileno())
+        # mkstemp creates the file as 0600, keep the target mode or the one a plain save would give.
+        os.chmod(tmp_path, _output_mode(path))
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+    # Persist the rename itself. Not supported on Windows.
+    if hasattr(os, "O_DIRECTORY"):
+        dir_fd = os.open(directory, os.O_RDONLY | os.O_DIRECTORY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+
+def _output_mode(path: str) -> int:
+    """Returns the permissions of path if it exists, otherwise the default ones for a new file."""
+    try:
+        return stat.S_IMODE(os.stat(path).st_mode)
+    except FileNotFoundError:
+        return 0o666 & ~_UMASK
+
+class BackgroundWriter:
+    """Runs atomic_save calls one after the other on a background thread.
+    The first save error is raised again by the next submit() or by close().
+    Saves queued after an error are skipped until it is raised, each skipped path is printed."""
+    def __init__(self):
+        self._queue = queue.Queue()
+        self._error = None
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name="csu-writer", daemon=True)
+        self._thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            save, path = item
+            if self._error is not None:
+                print(f"ERROR : save to '{path}' skipped after a previous save error.")
+                continue
+            try:
+                atomic_save(save, path)
+            except Exception as e: # pylint: disable=broad-exception-caught
+                self._error = e
+
+    def _raise_error(self):
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise error
+
+    def submit(self, save, path: str):
+        """Queues save(tmp_path) to be atomically written to path."""
+        if self._closed:
+            raise RuntimeError("BackgroundWriter is closed, save cannot be queued.")
+        self._raise_error()
+        self._queue.put((save, path))
+
+    def close(self):
+        """Waits for all queued saves to be written."""
+        self._closed = True
+        if self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join()
+        self._raise_error()
@@ -0,0 +1,285 @@
+#!/usr/bin/env python3
+"""Module that contains the price providers used in main module."""
+
+import abc
+import collections
+import json
+import math
+import queue
+import threading
+import time
+
+import requests
+
+from csu_types import Coin
+from csu_helpers import round_float, atomic_save
+
+class ProviderError(Exception):
+    """Raised when a provider cannot return prices for a token set."""
+
+class LatencyStats:
+    """Stores the last successful response times of a provider, in seconds."""
+    def __init__(self, size: int = 100, min_samples: int = 5):
+        self.min_samples = min_samples
+        self._samples = collections.deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def add(self, seconds: float):
+        """Records a response time."""
+        with self._lock:
+            self._samples.append(seconds)
+
+    def extend(self, samples: list[float]):
+        """Records response times, for example the ones saved by a previous run."""
+        with self._lock:
+            self._samples.extend(samples)
+
+    def samples(self) -> list[float]:
+        """Returns the recorded response times, oldest first."""
+        with self._lock:
+            return list(self._samples)
+
+    def percentile(self, percent: float):
+        """Returns the nearest-rank percentile, or None while there are too few samples."""
+        with self._lock:
+            samples = sorted(self._samples)
+
+        if len(samples) < self.min_samples:
+            return None
+
+        rank = max(1, math.ceil(percent / 100 * len(samples)))
+        return samples[min(rank, len(samples)) - 1]
+
+class PriceProvider(abc.ABC):
+    """Base class of price providers. Subclasses implement _fetch()."""
+    name = "provider"
+
+    def __init__(self, timeout: float = 10):
+        self.timeout = timeout
+        self.stats = LatencyStats()
+
+    def fetch(self, token_set: str, warnings: list = None) -> list[Coin]:
+        """Returns a list of Coins for a token set like "BTC,ETH,SOL", in the same order.
+        Per-coin warnings are printed, or appended to warnings when it is given.
+        Raises ProviderError on failure."""
+        fetch_warnings = []
+        start = time.monotonic()
+        coins = self._fetch(token_set, fetch_warnings)
+        self.stats.add(time.monotonic() - start)
+
+        if warnings is None:
+            for warning in fetch_warnings:
+                print(warning)
+        else:
+            warnings.extend(fetch_warnings)
+        return coins
+
+    def close(self):
+        """Releases the resources held by the provider."""
+
+    @abc.abstractmethod
+    def _fetch(self, token_set: str, warnings: list) -> list[Coin]:
+        """Returns a list of Coins for a token set, raises ProviderError on failure.
+        Per-coin problems are appended to warnings instead of being printed."""
+
+    def _get_json(self, url: str, params: dict, headers: dict):
+        try:
+            response = requests.get(url, params=params, headers=headers, timeout=self.timeout)
+            return response.json()
+        except (requests.ConnectTimeout, requests.HTTPError, requests.ReadTimeout,\
+                requests.Timeout, requests.ConnectionError, requests.exceptions.MissingSchema,\
+                requests.exceptions.InvalidURL) as e:
+            raise ProviderError(f"ERROR : {e}. Check the configured URL for {self.name}.") from e
+        except ValueError as e:
+            raise ProviderError(f"ERROR : invalid JSON response from {self.name} for '{params}'.") from e
+
+class CMCProvider(PriceProvider):
+    """Gets prices from CoinMarketCap API."""
+    name = "CoinMarketCap"
+
+    def __init__(self, url: str, token: str, timeout: float = 10):
+        super().__init__(timeout)
+        self.url = url
+        self.token = token
+
+    def _fetch(self, token_set: str, warnings: list) -> list[Coin]:
+        rsp_json = self._get_json(self.url, {"symbol": token_set}, {"X-CMC_PRO_API_KEY": self.token})
+
+        # Raise in case of error.
+        if "status" not in rsp_json:
+            raise ProviderError(f"ERROR : unable to retrieve 'status' key in response for '{token_set}'. Brut response : {rsp_json}")
+
+        if "error_code" not in rsp_json["status"]:
+            raise ProviderError(f"ERROR : unable to retrieve 'status' key in response for '{token_set}'. Brut response : {rsp_json}")
+
+        if rsp_json["status"]["error_code"] != 0:
+            error_message = rsp_json.get("status", {}).get("error_message", "Unknown error")
+            raise ProviderError(f"ERROR : unable to fetch data for '{token_set}': {error_message}")
+
+        # Otherwise formats and returns a list of Coins.
+        coins = []
+        for coin_name in token_set.split(","):
+            value = rsp_json["data"].get(coin_name, {})
+            if value:
+                price = value[0]["quote"]["USD"]["price"]
+                if price is None:
+                    warnings.append(f"ERROR : no price for {coin_name}, price set to 0. Continuing.")
+                coins.append(Coin(coin_name, round_float(price)))
+            else:
+                warnings.append(f"ERROR : no value for {coin_name}, value set to 0. Continuing.")
+                coins.append(Coin(coin_name, 0))
+
+        return coins
+
+class JSONQuotesProvider(PriceProvider):
+    """Gets prices from any HTTP API answering GET url?symbol=BTC,ETH with JSON.
+    prices_path is the list of keys leading to the {symbol: quote} object and
+    price_path the list of keys leading from a quote to its price.
+    With empty paths the expected response is {"BTC": 68000.0, "ETH": 2500.0}.
+    Prices may be numbers or numeric strings."""
+    name = "JSON quotes"
+
+    def __init__(self, url: str, headers: dict = None, symbol_param: str = "symbol",
+                 prices_path: list = None, price_path: list = None, timeout: float = 10):
+        super().__init__(timeout)
+        self.url = url
+        self.headers = headers or {}
+        self.symbol_param = symbol_param
+        self.prices_path = prices_path or []
+        self.price_path = price_path or []
+
+    def _fetch(self, token_set: str, warnings: list) -> list[Coin]:
+        rsp_json = self._get_json(self.url, {self.symbol_param: token_set}, self.headers)
+
+        try:
+            prices = _follow_path(rsp_json, self.prices_path)
+        except (KeyError, IndexError, TypeError) as e:
+            raise ProviderError(f"ERROR : unable to find prices in response for '{token_set}'. Brut response : {rsp_json}") from e
+
+        coins = []
+        for coin_name in token_set.split(","):
+            try:
+                price = _follow_path(prices[coin_name], self.price_path)
+            except (KeyError, IndexError, TypeError):
+                warnings.append(f"ERROR : no value for {coin_name}, value set to 0. Continuing.")
+                coins.append(Coin(coin_name, 0))
+                continue
+
+            # Many APIs send prices as strings, like "68000.12".
+            try:
+                price = float(price)
+            except (TypeError, ValueError):
+                warnings.append(f"ERROR : no price for {coin_name}, price set to 0. Continuing.")
+                coins.append(Coin(coin_name, 0))
+                continue
+
+            coins.append(Coin(coin_name, round_float(price)))
+
+        return coins
+
+class HedgedProvider(PriceProvider):
+    """Sends a token set to the primary provider, and also to the secondary one if the primary
+    has not answered within its own latency percentile or has failed. First answer wins.
+    Requests run on daemon threads, so a losing request never delays the end of the process.
+    When stats_path is given, latency samples are loaded from it and saved to it by close(),
+    so the hedge delay also tunes itself across short runs."""
+    name = "hedged"
+
+    def __init__(self, primary: PriceProvider, secondary: PriceProvider,
+                 percentile: float = 95, initial_delay: float = 1, stats_path: str = ""):
+        super().__init__(primary.timeout)
+        self.primary = primary
+        self.secondary = secondary
+        self.percentile = percentile
+        self.initial_delay = initial_delay
+        self.stats_path = stats_path
+        self._load_stats()
+
+    def hedge_delay(self) -> float:
+        """Returns how long to wait for the primary provider before asking the secondary one."""
+        delay = self.primary.stats.percentile(self.percentile)
+        return self.initial_delay if delay is None else delay
+
+    def close(self):
+        """Saves the latency samples to stats_path. Losing requests are left to their daemon threads."""
+        if not self.stats_path:
+            return
+
+        stats = {provider.name: provider.stats.samples() for provider in (self.primary, self.secondary)}
+
+        def save(path):
+            with open(path, "w", encoding="utf-8") as f:
+                json.dump(stats, f)
+
+        try:
+            atomic_save(save, self.stats_path)
+        except OSError as e:
+            print(f"ERROR : unable to save latency stats to '{self.stats_path}': {e}. Continuing.")
+
+    def _load_stats(self):
+        if not self.stats_path:
+            return
+
+        try:
+            with open(self.stats_path, encoding="utf-8") as f:
+                stats = json.load(f)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            print(f"ERROR : unable to read latency stats from '{self.stats_path}': {e}. Continuing.")
+            return
+
+        for provider in (self.primary, self.secondary):
+            samples = stats.get(provider.name, []) if isinstance(stats, dict) else []
+            provider.stats.extend(sample for sample in samples if isinstance(sample, (int, float)))
+
+    def _fetch(self, token_set: str, warnings: list) -> list[Coin]:
+        answers = queue.Queue()
+
+        def ask(provider):
+            # Warnings are kept apart, so only the ones of the answer used are printed.
+            provider_warnings = []
+            try:
+                coins = provider.fetch(token_set, provider_warnings)
+                answers.put((provider, coins, provider_warnings, None))
+            except Exception as e: # pylint: disable=broad-exception-caught
+                answers.put((provider, None, None, e))
+
+        threading.Thread(target=ask, args=(self.primary,), name="csu-primary", daemon=True).start()
+        pending = 1
+        errors = []
+
+        try:
+            answer = answers.get(timeout=self.hedge_delay())
+            pending -= 1
+            if answer[3] is None:
+                return self._use(answer, errors, warnings)
+            errors.append(answer[3])
+        except queue.Empty:
+            pass
+
+        threading.Thread(target=ask, args=(self.secondary,), name="csu-secondary", daemon=True).start()
+        pending += 1
+
+        while pending:
+            answer = answers.get()
+            pending -= 1
+            if answer[3] is None:
+                return self._use(answer, errors, warnings)
+            errors.append(answer[3])
+
+        raise ProviderError(" / ".join(str(e) for e in errors))
+
+    @staticmethod
+    def _use(answer, errors: list, warnings: list) -> list[Coin]:
+        """Reports the errors of the providers that failed and returns the coins of answer."""
+        provider, coins, provider_warnings, _ = answer
+        for error in errors:
+            print(f"{error} Continuing with {provider.name}.")
+        warnings.extend(provider_warnings)
+        return coins
+
+def _follow_path(value, path: list):
+    for key in path:
+        value = value[key]
+    return value
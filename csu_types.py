@@ -109,3 +109,20 @@ class Config:
         self.cmc_api_token = config.cmc_api["token"]
         if not self.input_path:
             sys.exit("cmc_api_token is empty.")
+
+        fallback_api = getattr(config, "fallback_api", {})
+        self.fallback_api_url = fallback_api.get("url", "")
+        self.fallback_api_headers = fallback_api.get("headers", {})
+        self.fallback_api_symbol_param = fallback_api.get("symbol_param", "symbol")
+        self.fallback_api_prices_path = fallback_api.get("prices_path", [])
+        self.fallback_api_price_path = fallback_api.get("price_path", [])
+
+        self.hedge_percentile = fallback_api.get("hedge_percentile", 95)
+        if not 0 < self.hedge_percentile <= 100:
+            sys.exit("hedge_percentile must be between 1 and 100.")
+
+        self.hedge_initial_delay = fallback_api.get("hedge_initial_delay", 1)
+        if self.hedge_initial_delay < 0:
+            sys.exit("hedge_initial_delay cannot be inferior to 0.")
+
+        self.latency_stats_path = fallback_api.get("latency_stats_path", "")
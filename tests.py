@@ -1,10 +1,23 @@
 #!/usr/bin/env python3
 """Testing module for csu.py"""
 
+import contextlib
+import io
+import json
+import os
+import stat
+import subprocess
+import sys
+import tempfile
+import threading
+import time
 import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
 
 from csu_types import Config, CSUConfig, SheetType, Coin
-from csu_helpers import round_float
+from csu_helpers import round_float, atomic_save, BackgroundWriter
+from csu_providers import LatencyStats, PriceProvider, ProviderError, CMCProvider, JSONQuotesProvider, HedgedProvider
 from csu import load_numbers_doc, load_excel_doc, prepare_dataset, get_data_from_cmc_api, update_numbers_sheet, update_excel_sheet
 
 class CSUNumbersConfigTest:
@@ -59,6 +72,48 @@ class CSUExcelConfigTest:
         "token": "token1"
     }
 
+class StandInServer:
+    """Local HTTP server answering GET ?symbol=BTC,ETH with answer(symbols) as JSON after delay seconds."""
+    def __init__(self, answer, delay: float = 0):
+        stand_in = self
+        self.answer = answer
+        self.delay = delay
+
+        class Handler(BaseHTTPRequestHandler):
+            """Request handler of the stand-in server."""
+            def do_GET(self): # pylint: disable=invalid-name
+                """Answers after the configured delay."""
+                time.sleep(stand_in.delay)
+                symbols = parse_qs(urlparse(self.path).query).get("symbol", [""])[0].split(",")
+                body = json.dumps(stand_in.answer(symbols)).encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args): # pylint: disable=redefined-builtin
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.server.server_port}/quotes"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self):
+        """Stops the server."""
+        self.server.shutdown()
+        self.server.server_close()
+
+def cmc_answer(symbols):
+    """CoinMarketCap shaped answer with a price of 1.5 for each known symbol."""
+    data = {s: [{"quote": {"USD": {"price": 1.5}}}] for s in symbols if s != "TOTOZ"}
+    return {"status": {"error_code": 0}, "data": data}
+
+def quotes_answer(symbols):
+    """Flat answer with a price of 2.5 for each symbol."""
+    return {s: 2.5 for s in symbols}
+
 class ConfigTests(unittest.TestCase):
     """Tests of configuration functions and types."""
     def test_init_good_config(self):
@@ -291,6 +346,195 @@ class CMCAPITests(unittest.TestCase):
         self.assertEqual(excel_doc.rows[2][config_test_ex.table_coin_price_col_index], coins[1].price)
         self.assertEqual(excel_doc.rows[3][config_test_ex.table_coin_price_col_index], coins[2].price)
 
+    def test_update_excel_sheet_in_background(self):
+        """Tries to write an Excel sheet from the background writer and read it to check data."""
+        config_test_ex = Config(CSUExcelConfigTest())
+        excel_doc = load_excel_doc(config_test_ex)
+
+        coins = [Coin(excel_doc.rows[1][0], 1.5),
+                 Coin(excel_doc.rows[2][0], 2.5),
+                 Coin(excel_doc.rows[3][0], 3.5)]
+        with BackgroundWriter() as writer:
+            update_excel_sheet(excel_doc, coins, config_test_ex, writer)
+
+        config_test_ex.input_path = config_test_ex.output_path
+        excel_doc = load_excel_doc(config_test_ex)
+
+        self.assertEqual(excel_doc.rows[1][config_test_ex.table_coin_price_col_index], coins[0].price)
+        self.assertEqual(excel_doc.rows[3][config_test_ex.table_coin_price_col_index], coins[2].price)
+
+class ProvidersTests(unittest.TestCase):
+    """Tests for csu_providers module, against local stand-in servers."""
+    def setUp(self):
+        self.servers = []
+
+    def tearDown(self):
+        for server in self.servers:
+            server.close()
+
+    def serve(self, answer, delay: float = 0) -> StandInServer:
+        """Starts a stand-in server closed at the end of the test."""
+        server = StandInServer(answer, delay)
+        self.servers.append(server)
+        return server
+
+    def test_cmc_provider(self):
+        """Tries to get prices from a CoinMarketCap stand-in. Order should be conserved."""
+        provider = CMCProvider(self.serve(cmc_answer).url, "token1")
+
+        coins = provider.fetch("SOL,TOTOZ,BTC")
+
+        self.assertEqual([coin.name for coin in coins], ["SOL", "TOTOZ", "BTC"])
+        self.assertEqual([coin.price for coin in coins], [1.5, 0, 1.5])
+
+    def test_json_quotes_provider_paths(self):
+        """Tries to get prices from a nested JSON answer."""
+        server = self.serve(lambda symbols: {"result": {s: {"usd": 3.5} for s in symbols}})
+        provider = JSONQuotesProvider(server.url, prices_path=["result"], price_path=["usd"])
+
+        coins = provider.fetch("BTC,ETH")
+
+        self.assertEqual([coin.price for coin in coins], [3.5, 3.5])
+
+    def test_hedged_provider_slow_primary(self):
+        """Primary answers after 30s, so the secondary answer should win after the hedge delay."""
+        primary = CMCProvider(self.serve(cmc_answer, delay=30).url, "token1")
+        secondary = JSONQuotesProvider(self.serve(quotes_answer).url)
+        provider = HedgedProvider(primary, secondary, initial_delay=0.1)
+
+        start = time.monotonic()
+        coins = provider.fetch("BTC,ETH")
+        provider.close()
+
+        self.assertLess(time.monotonic() - start, 10)
+        self.assertEqual([coin.price for coin in coins], [2.5, 2.5])
+
+    def test_hedged_provider_primary_down(self):
+        """Primary is unreachable, so the secondary should be used without waiting the hedge delay."""
+        server = self.serve(cmc_answer)
+        url = server.url
+        server.close()
+        self.servers.remove(server)
+
+        provider = HedgedProvider(CMCProvider(url, "token1"), JSONQuotesProvider(self.serve(quotes_answer).url),
+                                  initial_delay=30)
+
+        start = time.monotonic()
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            coins = provider.fetch("BTC")
+        provider.close()
+
+        self.assertLess(time.monotonic() - start, 10)
+        self.assertEqual(coins[0].price, 2.5)
+
+        # The primary error is reported, not hidden by the fallback.
+        self.assertIn("ERROR : ", output.getvalue())
+        self.assertIn("Continuing with JSON quotes.", output.getvalue())
+
+    def test_hedged_provider_loser_quiet(self):
+        """Only the warnings of the answer used should be printed, not the ones of the slow primary."""
+        primary = CMCProvider(self.serve(cmc_answer, delay=1).url, "token1")
+        provider = HedgedProvider(primary, JSONQuotesProvider(self.serve(quotes_answer).url), initial_delay=0.1)
+
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            coins = provider.fetch("BTC,TOTOZ")
+
+            # Wait for the primary to answer, its TOTOZ warning must not be printed.
+            deadline = time.monotonic() + 20
+            while not primary.stats.samples() and time.monotonic() < deadline:
+                time.sleep(0.05)
+        provider.close()
+
+        self.assertEqual(len(primary.stats.samples()), 1)
+        self.assertEqual([coin.price for coin in coins], [2.5, 2.5])
+        self.assertEqual(output.getvalue(), "")
+
+    def test_json_quotes_provider_string_prices(self):
+        """Prices sent as strings should be converted, unreadable ones set to 0."""
+        server = self.serve(lambda symbols: {"BTC": "68000.12", "ETH": "n/a", "SOL": None})
+        provider = JSONQuotesProvider(server.url)
+
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            coins = provider.fetch("BTC,ETH,SOL")
+
+        self.assertEqual([coin.price for coin in coins], [68000.12, 0, 0])
+        self.assertIn("no price for ETH", output.getvalue())
+        self.assertIn("no price for SOL", output.getvalue())
+
+    def test_hedged_provider_all_down(self):
+        """Both providers fail. A ProviderError should be raised."""
+        failing = lambda symbols: {"status": {"error_code": 1, "error_message": "down"}}
+        provider = HedgedProvider(CMCProvider(self.serve(failing).url, "token1"),
+                                  JSONQuotesProvider("http://127.0.0.1:1/quotes"))
+
+        with self.assertRaises(ProviderError):
+            provider.fetch("BTC")
+        provider.close()
+
+    def test_latency_stats(self):
+        """Hedge delay should follow the primary latency percentile once enough samples are known."""
+        stats = LatencyStats(min_samples=5)
+        for seconds in [0.1, 0.2, 0.3, 0.4]:
+            stats.add(seconds)
+        self.assertIsNone(stats.percentile(95))
+
+        for seconds in [0.5, 0.6, 0.7, 0.8, 0.9, 1.0]:
+            stats.add(seconds)
+        self.assertEqual(stats.percentile(50), 0.5)
+        self.assertEqual(stats.percentile(95), 1.0)
+        self.assertEqual(stats.percentile(1), 0.1)
+
+        # Nearest-rank on .5 ranks goes up, 2.5 -> 3 and 8.5 -> 9.
+        self.assertEqual(stats.percentile(25), 0.3)
+        self.assertEqual(stats.percentile(85), 0.9)
+
+    def test_provider_without_fetch(self):
+        """A provider that does not implement _fetch should fail when created."""
+        class BrokenProvider(PriceProvider): # pylint: disable=abstract-method
+            """Provider missing _fetch."""
+
+        with self.assertRaises(TypeError):
+            BrokenProvider()
+
+    def test_hedged_provider_stats_saved(self):
+        """Latency samples should be saved by close() and loaded by the next provider."""
+        primary_url = self.serve(cmc_answer).url
+        secondary_url = self.serve(quotes_answer).url
+
+        with tempfile.TemporaryDirectory() as directory:
+            stats_path = os.path.join(directory, "latency.json")
+
+            provider = HedgedProvider(CMCProvider(primary_url, "token1"), JSONQuotesProvider(secondary_url),
+                                      initial_delay=5, stats_path=stats_path)
+            for _ in range(5):
+                provider.fetch("BTC")
+            provider.close()
+
+            provider = HedgedProvider(CMCProvider(primary_url, "token1"), JSONQuotesProvider(secondary_url),
+                                      initial_delay=5, stats_path=stats_path)
+            self.assertEqual(len(provider.primary.stats.samples()), 5)
+            self.assertLess(provider.hedge_delay(), 5)
+
+    def test_hedged_provider_exit_not_delayed(self):
+        """The process should exit once the secondary has answered, without waiting for the slow primary."""
+        primary_url = self.serve(cmc_answer, delay=30).url
+        secondary_url = self.serve(quotes_answer).url
+        script = "from csu_providers import CMCProvider, JSONQuotesProvider, HedgedProvider\n"\
+                 f"provider = HedgedProvider(CMCProvider('{primary_url}', 'token1'), "\
+                 f"JSONQuotesProvider('{secondary_url}'), initial_delay=0.1)\n"\
+                 "print(provider.fetch('BTC')[0].price)\n"\
+                 "provider.close()\n"
+
+        start = time.monotonic()
+        result = subprocess.run([sys.executable, "-c", script], cwd=os.path.dirname(os.path.abspath(__file__)),
+                                capture_output=True, text=True, timeout=60, check=True)
+
+        self.assertLess(time.monotonic() - start, 15)
+        self.assertEqual(result.stdout.strip(), "2.5")
+
 class HelpersTests(unittest.TestCase):
     """Tests for csu_helpers module."""
     def test_round_float(self):
@@ -309,5 +553,63 @@ class HelpersTests(unittest.TestCase):
         self.assertEqual(round_float(100000), 100000)
         self.assertEqual(round_float(1000000000000005), 1000000000000005)
 
+    def test_atomic_save(self):
+        """Tries to replace a file, then to fail a save. Old file should be kept without temp files."""
+        def write(content):
+            def save(path):
+                with open(path, "w", encoding="utf-8") as f:
+                    f.write(content)
+            return save
+
+        def fail(path):
+            with open(path, "w", encoding="utf-8") as f:
+                f.write("partial")
+            raise OSError("disk full")
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "out.xlsx")
+            atomic_save(write("first"), path)
+            atomic_save(write("second"), path)
+
+            with self.assertRaises(OSError):
+                atomic_save(fail, path)
+
+            with open(path, encoding="utf-8") as f:
+                self.assertEqual(f.read(), "second")
+            self.assertEqual(os.listdir(directory), ["out.xlsx"])
+
+            # New files get the default mode, existing ones keep theirs. Windows only has a read-only flag.
+            if os.name == "posix":
+                umask = os.umask(0)
+                os.umask(umask)
+                new_path = os.path.join(directory, "new.xlsx")
+                atomic_save(write("new"), new_path)
+                self.assertEqual(stat.S_IMODE(os.stat(new_path).st_mode), 0o666 & ~umask)
+
+                os.chmod(path, 0o640)
+                atomic_save(write("third"), path)
+                self.assertEqual(stat.S_IMODE(os.stat(path).st_mode), 0o640)
+
+    def test_background_writer_error(self):
+        """Tries to fail a save on the background writer. Error should be raised on close."""
+        def fail(path):
+            raise OSError(f"cannot write {path}")
+
+        with tempfile.TemporaryDirectory() as directory:
+            writer = BackgroundWriter()
+            writer.submit(fail, os.path.join(directory, "out.xlsx"))
+
+            with self.assertRaises(OSError):
+                writer.close()
+            self.assertEqual(os.listdir(directory), [])
+
+    def test_background_writer_closed(self):
+        """Tries to submit a save after close. It should be refused, not dropped."""
+        writer = BackgroundWriter()
+        writer.close()
+
+        with self.assertRaises(RuntimeError):
+            writer.submit(lambda path: None, "out.xlsx")
+
 if __name__ == "__main__":
     unittest.main()